@@ -0,0 +1,42 @@
+"""scene acquisition date indexes
+
+Revision ID: 5e0c7a91d2f4
+Revises: b172e55c1b68
+Create Date: 2026-10-15 09:48:05.604117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "5e0c7a91d2f4"
+down_revision: Union[str, Sequence[str], None] = "b172e55c1b68"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_scene_acq_date_brin",
+        "scene",
+        ["acquisition_date"],
+        unique=False,
+        postgresql_using="brin",
+        postgresql_with={"pages_per_range": 32},
+    )
+    op.create_index(
+        "ix_scene_status_acquisition_date",
+        "scene",
+        ["status", sa.text("acquisition_date DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_scene_status_acquisition_date", table_name="scene")
+    op.drop_index("ix_scene_acq_date_brin", table_name="scene")
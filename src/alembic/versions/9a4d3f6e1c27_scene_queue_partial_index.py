@@ -0,0 +1,46 @@
+"""scene queue partial index
+
+Revision ID: 9a4d3f6e1c27
+Revises: 5e0c7a91d2f4
+Create Date: 2026-10-15 10:31:52.907356
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "9a4d3f6e1c27"
+down_revision: Union[str, Sequence[str], None] = "5e0c7a91d2f4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the partial covering index replaces the full status/date index, so scene
+    # status updates maintain one btree less
+    op.drop_index("ix_scene_status_acquisition_date", table_name="scene")
+    op.create_index(
+        "ix_scene_queue",
+        "scene",
+        ["status", sa.text("acquisition_date DESC")],
+        unique=False,
+        postgresql_include=["scene_id"],
+        postgresql_where=sa.text(
+            "status IN ('queued_for_download', 'queued_for_processing')"
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_scene_queue", table_name="scene")
+    op.create_index(
+        "ix_scene_status_acquisition_date",
+        "scene",
+        ["status", sa.text("acquisition_date DESC")],
+        unique=False,
+    )
@@ -0,0 +1,54 @@
+"""project aoi spgist index
+
+Revision ID: b172e55c1b68
+Revises: db3ee7e5f4f2
+Create Date: 2026-10-15 09:12:41.318204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "b172e55c1b68"
+down_revision: Union[str, Sequence[str], None] = "db3ee7e5f4f2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_geospatial_index(
+        "idx_project_area_of_interest",
+        table_name="project",
+        postgresql_using="gist",
+        column_name="area_of_interest",
+    )
+    op.create_geospatial_index(
+        "idx_project_area_of_interest",
+        "project",
+        ["area_of_interest"],
+        unique=False,
+        postgresql_using="spgist",
+        postgresql_ops={},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_geospatial_index(
+        "idx_project_area_of_interest",
+        table_name="project",
+        postgresql_using="spgist",
+        column_name="area_of_interest",
+    )
+    op.create_geospatial_index(
+        "idx_project_area_of_interest",
+        "project",
+        ["area_of_interest"],
+        unique=False,
+        postgresql_using="gist",
+        postgresql_ops={},
+    )
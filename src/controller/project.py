@@ -1,6 +1,7 @@
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from sqlalchemy import func
+from sqlalchemy.orm import raiseload
 from sqlalchemy.sql import select, update
 
 from src.utils.db import get_session
@@ -12,7 +13,9 @@ class ProjectController:
     def get_project_by_id(project_id: str) -> Optional[Project]:
         with get_session() as session:
             project = session.execute(
-                select(Project).where(Project.project_id == project_id)
+                select(Project)
+                .options(raiseload("*"))
+                .where(Project.project_id == project_id)
             ).scalar_one_or_none()
             return project
 
@@ -29,16 +32,47 @@ class ProjectController:
     @staticmethod
     def get_glaciers_in_project(project_id: str):
         with get_session() as session:
-            subq = (
-                session.query(Project.area_of_interest)
-                .filter(Project.project_id == project_id)
-                .scalar_subquery()
-            )
-
             glaciers = (
-                session.query(Glacier)
-                .filter(func.ST_WITHIN(Glacier.geometry, subq))
+                session.execute(
+                    select(Glacier)
+                    .options(raiseload("*"))
+                    .join(
+                        Project,
+                        func.ST_Within(Glacier.geometry, Project.area_of_interest),
+                    )
+                    .where(Project.project_id == project_id)
+                )
+                .scalars()
                 .all()
             )
 
             return glaciers
+
+    @staticmethod
+    def get_glacier_geometries_in_project(
+        project_id: str,
+    ) -> Tuple[List[str], List[bytes]]:
+        """
+        Get the names and WKB geometries of the named glaciers in the project,
+        selecting only those two columns instead of loading Glacier objects.
+
+        Returns a tuple (names, wkbs) of parallel lists.
+        """
+        with get_session() as session:
+            rows = session.execute(
+                select(Glacier.name, func.ST_AsBinary(Glacier.geometry))
+                .join(
+                    Project,
+                    func.ST_Within(Glacier.geometry, Project.area_of_interest),
+                )
+                .where(
+                    Project.project_id == project_id,
+                    Glacier.name.is_not(None),
+                    Glacier.name != "",
+                )
+            ).all()
+
+        names = [name for name, _ in rows]
+        wkbs = [bytes(wkb) for _, wkb in rows]
+
+        return names, wkbs
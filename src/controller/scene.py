@@ -1,18 +1,53 @@
 from logging import Logger
-from typing import List, Optional
+from typing import List, Optional, Set
 
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import raiseload
 from sqlalchemy.sql import select, text, update
 
 from src.utils.db import get_session
 from src.utils.models import Scene, SceneStatusEnum
 
 
+def _build_update_stmt(scene_id, new_status: SceneStatusEnum, **kwargs):
+    """
+    Build the UPDATE statement moving a scene to new_status.
+
+    See SceneController.update_scene_status for the parameters each status requires.
+    """
+    scene_table = Scene.__table__
+
+    update_stmt = (
+        update(scene_table)
+        .where(scene_table.c.scene_id == scene_id)
+        .values(status=new_status, updated_at=text("CURRENT_TIMESTAMP"))
+    )
+    match new_status:
+        case SceneStatusEnum.processed:
+            update_stmt = update_stmt.values(result_path=kwargs["result_path"])
+        case SceneStatusEnum.queued_for_processing | SceneStatusEnum.downloaded:
+            update_stmt = update_stmt.values(download_path=kwargs["download_path"])
+        case SceneStatusEnum.failed_processing:
+            update_stmt = update_stmt.values(
+                last_error=kwargs["error_message"],
+                attempts_processing=scene_table.c.attempts_processing + 1,
+            )
+        case SceneStatusEnum.failed_download:
+            update_stmt = update_stmt.values(
+                last_error=kwargs["error_message"],
+                attempts_download=scene_table.c.attempts_download + 1,
+            )
+
+    return update_stmt
+
+
 class SceneController:
     @staticmethod
     def get_scene(status: SceneStatusEnum) -> Optional[Scene]:
         with get_session() as session:
             select_stmt = (
                 select(Scene)
+                .options(raiseload("*"))
                 .where(Scene.status == status)
                 .order_by(Scene.acquisition_date.desc())
                 .limit(1)
@@ -23,21 +58,42 @@ class SceneController:
     @staticmethod
     def get_scene_by_id(scene_id: str) -> Optional[Scene]:
         with get_session() as session:
-            scene = select(Scene).where(Scene.scene_id == scene_id)
+            scene = (
+                select(Scene).options(raiseload("*")).where(Scene.scene_id == scene_id)
+            )
             scene = session.execute(scene).scalar_one_or_none()
             return scene
 
     @staticmethod
-    def get_scenes_by_ids(scene_ids: List[str]) -> List[Scene]:
+    def get_existing_scene_ids(scene_ids: Set[str]) -> Set[str]:
+        """
+        Return the subset of scene_ids already stored, selecting only the key
+        column so no Scene objects are built.
+        """
         with get_session() as session:
-            scenes = select(Scene).where(Scene.scene_id.in_(scene_ids))
-            scenes = session.execute(scenes).scalars().all()
-            return scenes
+            select_stmt = select(Scene.scene_id).where(Scene.scene_id.in_(scene_ids))
+            return set(session.execute(select_stmt).scalars().all())
 
     @staticmethod
     def add_scenes(scenes: List[Scene]):
+        """
+        Insert the scenes in batched multi-row INSERTs, skipping scene IDs that
+        already exist (e.g. added by a concurrent discover run).
+        """
+        if not scenes:
+            return
+
+        columns = Scene.__table__.columns.keys()
+        rows = [
+            {key: value for key, value in vars(scene).items() if key in columns}
+            for scene in scenes
+        ]
+
         with get_session() as session:
-            session.add_all(scenes)
+            session.execute(
+                insert(Scene).on_conflict_do_nothing(index_elements=["scene_id"]),
+                rows,
+            )
             session.commit()
 
     @staticmethod
@@ -48,36 +104,30 @@ class SceneController:
             row = session.execute(
                 text(
                     """
-            SELECT * FROM scene
-            WHERE status = :status
-            ORDER BY acquisition_date DESC
-            LIMIT 1
-            FOR UPDATE SKIP LOCKED
+            WITH next_scene AS (
+                SELECT scene_id FROM scene
+                WHERE status = :start_status
+                ORDER BY acquisition_date DESC
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE scene
+            SET status = :end_status, updated_at = CURRENT_TIMESTAMP
+            FROM next_scene
+            WHERE scene.scene_id = next_scene.scene_id
+            RETURNING scene.*
             """,
                 ),
-                params={"status": start_status},
+                params={"start_status": start_status, "end_status": end_status},
             ).first()
 
+            session.commit()
+
         if row is None:
             logger.info(f"No scenes queued for {start_status}.")
             return None
 
-        logger.info(f"Locking scene: {row.scene_id}")
-
-        session.execute(
-            text(
-                """
-            UPDATE scene
-            SET status = :status, updated_at = CURRENT_TIMESTAMP
-            WHERE scene_id = :scene_id
-            """
-            ),
-            params={"scene_id": row.scene_id, "status": end_status},
-        )
-
-        session.commit()
-
-        logger.info(f"Scene {row.scene_id} status updated to {end_status}.")
+        logger.info(f"Scene {row.scene_id} locked and status updated to {end_status}.")
 
         return row
 
@@ -151,61 +201,16 @@ class SceneController:
             - failed_download: requires error_message (str)
         """
 
+        update_stmt = _build_update_stmt(
+            scene.scene_id,
+            new_status,
+            **{key: str(value) for key, value in kwargs.items()},
+        )
+
         if session is not None:
             # Use the provided session
-            update_stmt = (
-                update(Scene)
-                .where(Scene.scene_id == scene.scene_id)
-                .values(status=new_status, updated_at=text("CURRENT_TIMESTAMP"))
-            )
-            match new_status:
-                case SceneStatusEnum.processed:
-                    update_stmt = update_stmt.values(
-                        result_path=str(kwargs["result_path"])
-                    )
-                case SceneStatusEnum.queued_for_processing | SceneStatusEnum.downloaded:
-                    update_stmt = update_stmt.values(
-                        download_path=str(kwargs["download_path"])
-                    )
-                case SceneStatusEnum.failed_processing:
-                    update_stmt = update_stmt.values(
-                        last_error=kwargs["error_message"],
-                        attempts_processing=Scene.attempts_processing + 1,
-                    )
-                case SceneStatusEnum.failed_download:
-                    update_stmt = update_stmt.values(
-                        last_error=kwargs["error_message"],
-                        attempts_download=Scene.attempts_download + 1,
-                    )
             session.execute(update_stmt)
         else:
             with get_session() as session:
-                update_stmt = (
-                    update(Scene)
-                    .where(Scene.scene_id == scene.scene_id)
-                    .values(status=new_status, updated_at=text("CURRENT_TIMESTAMP"))
-                )
-                match new_status:
-                    case SceneStatusEnum.processed:
-                        update_stmt = update_stmt.values(
-                            result_path=str(kwargs["result_path"])
-                        )
-                    case (
-                        SceneStatusEnum.queued_for_processing
-                        | SceneStatusEnum.downloaded
-                    ):
-                        update_stmt = update_stmt.values(
-                            download_path=str(kwargs["download_path"])
-                        )
-                    case SceneStatusEnum.failed_processing:
-                        update_stmt = update_stmt.values(
-                            last_error=kwargs["error_message"],
-                            attempts_processing=Scene.attempts_processing + 1,
-                        )
-                    case SceneStatusEnum.failed_download:
-                        update_stmt = update_stmt.values(
-                            last_error=kwargs["error_message"],
-                            attempts_download=Scene.attempts_download + 1,
-                        )
                 session.execute(update_stmt)
                 session.commit()
@@ -1,13 +1,19 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Any, Dict, Optional
 
+import rasterio
 import rioxarray as rxr
 from geoalchemy2.shape import to_shape
-from shapely.geometry import mapping
 
 from src.controller.project import ProjectController
-from src.dem.utils import clip_remote_geotiff_vsicurl, mosaic_clipped_tifs
+from src.dem.utils import (
+    VSICURL_OPTIONS,
+    clip_remote_geotiff_vsicurl,
+    mosaic_clipped_tifs,
+)
 from src.utils.cog import is_cog
 from src.utils.dem_stac import DemStac
 from src.utils.geo import reproject_geom
@@ -15,6 +21,8 @@ from src.utils.logger import get_logger
 
 logger = get_logger("glacier_watch.discover")
 
+DEM_DOWNLOAD_WORKERS = 8
+
 
 def cut_dem_to_aoi(output_path: Path, dem_path: str, aoi_geometry) -> str:
     dem = rxr.open_rasterio(dem_path, masked=True).squeeze("band", drop=True)
@@ -25,7 +33,7 @@ def cut_dem_to_aoi(output_path: Path, dem_path: str, aoi_geometry) -> str:
         raise ValueError("DEM has no CRS; cannot clip/reproject AOI.")
 
     aoi_reprojected = reproject_geom(
-        [mapping(aoi_geometry)],
+        aoi_geometry,
         source_crs="EPSG:4326",
         target_crs=dem_crs.to_string(),
     )
@@ -44,6 +52,34 @@ def cut_dem_to_aoi(output_path: Path, dem_path: str, aoi_geometry) -> str:
     return output_path
 
 
+def clip_dem_item(
+    dem_item, aoi_geometry, temp_dir: str, aoi_by_crs: Dict[str, Any]
+) -> Optional[str]:
+    logger.info(f"Downloading DEM item {dem_item.id}")
+    href = dem_item.assets["dem"].href
+    logger.info(f"  Href: {href}")
+    is_cog_flag, info = is_cog(logger, href)
+    if not is_cog_flag:
+        logger.warning(f"  DEM item {dem_item.id} is not a COG. Info: {info}")
+    logger.info(f"  Is COG: {is_cog_flag}, Info: {info}")
+
+    temp_output_path = Path(temp_dir) / f"{dem_item.id}.tif"
+    # rasterio.Env options are per thread, so each worker enters its own
+    with rasterio.Env(**VSICURL_OPTIONS):
+        clipped_path = clip_remote_geotiff_vsicurl(
+            href,
+            aoi_geometry,
+            temp_output_path,
+            all_touched=True,
+            pad_pixels=2,
+            aoi_by_crs=aoi_by_crs,
+        )
+    if clipped_path:
+        logger.info(f"  Clipped DEM saved to {clipped_path}")
+
+    return clipped_path
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Glacier Data DEM Downloader")
     parser.add_argument(
@@ -76,28 +112,22 @@ if __name__ == "__main__":
     dem_stac = DemStac(logger)
     dem_items = dem_stac.search_dem_data(aoi_geometry)
 
+    # the AOI reprojected once per DEM CRS, shared by all tiles
+    aoi_by_crs = {}
+
     with TemporaryDirectory() as temp_dir:
-        clipped = []
-        for dem_item in dem_items:
-            logger.info(f"Downloading DEM item {dem_item.id}")
-            href = dem_item.assets["dem"].href
-            logger.info(f"  Href: {href}")
-            is_cog_flag, info = is_cog(logger, href)
-            if not is_cog_flag:
-                logger.warning(f"  DEM item {dem_item.id} is not a COG. Info: {info}")
-            logger.info(f"  Is COG: {is_cog_flag}, Info: {info}")
-
-            temp_output_path = Path(temp_dir) / f"{dem_item.id}.tif"
-            clipped_path = clip_remote_geotiff_vsicurl(
-                href,
-                aoi_geometry,
-                temp_output_path,
-                all_touched=True,
-                pad_pixels=2,
-            )
-            if clipped_path:
-                logger.info(f"  Clipped DEM saved to {clipped_path}")
-                clipped.append(clipped_path)
+        with ThreadPoolExecutor(max_workers=DEM_DOWNLOAD_WORKERS) as executor:
+            # map keeps the candidate order, which decides precedence in the mosaic
+            clipped = [
+                clipped_path
+                for clipped_path in executor.map(
+                    lambda dem_item: clip_dem_item(
+                        dem_item, aoi_geometry, temp_dir, aoi_by_crs
+                    ),
+                    dem_items,
+                )
+                if clipped_path
+            ]
 
         if not clipped:
             logger.error("No DEM data could be clipped to the AOI.")
@@ -1,5 +1,6 @@
+import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 import numpy as np
 import rasterio
@@ -7,10 +8,28 @@ from rasterio.enums import Resampling
 from rasterio.features import geometry_mask
 from rasterio.merge import merge
 from rasterio.windows import from_bounds
-from shapely.geometry import mapping
+from shapely.geometry import box, mapping
 
 from src.utils.geo import reproject_geom
 
+# GDAL settings for reading remote COGs over /vsicurl/, applied with rasterio.Env in
+# the thread doing the reads. Values already in the environment take precedence.
+VSICURL_OPTIONS = {
+    key: os.environ.get(key, default)
+    for key, default in {
+        "GDAL_CACHEMAX": "512",
+        "CPL_VSIL_CURL_CHUNK_SIZE": "1048576",
+        "CPL_VSIL_CURL_CACHE_SIZE": "200000000",
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "VSI_CACHE": "TRUE",
+        "VSI_CACHE_SIZE": "536870912",
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+        "GDAL_HTTP_MULTIPLEX": "YES",
+        "GDAL_HTTP_MAX_RETRY": "3",
+    }.items()
+}
+
 
 def clip_remote_geotiff_vsicurl(
     href: str,
@@ -19,6 +38,7 @@ def clip_remote_geotiff_vsicurl(
     *,
     all_touched: bool = True,
     pad_pixels: int = 2,
+    aoi_by_crs: Optional[Dict[str, Any]] = None,
 ) -> Optional[str]:
     vsicurl_path = f"/vsicurl/{href}"
     out_path = str(out_path)
@@ -28,7 +48,13 @@ def clip_remote_geotiff_vsicurl(
         if src.crs is None:
             raise ValueError(f"Source has no CRS: {href}")
 
-        aoi_src = reproject_geom(aoi_wgs84, "EPSG:4326", src.crs.to_string())
+        src_crs = src.crs.to_string()
+        if aoi_by_crs is None:
+            aoi_src = reproject_geom(aoi_wgs84, "EPSG:4326", src_crs)
+        else:
+            if src_crs not in aoi_by_crs:
+                aoi_by_crs[src_crs] = reproject_geom(aoi_wgs84, "EPSG:4326", src_crs)
+            aoi_src = aoi_by_crs[src_crs]
 
         raster_bounds = src.bounds
         aoi_bounds = aoi_src.bounds
@@ -62,25 +88,32 @@ def clip_remote_geotiff_vsicurl(
 
         win_transform = src.window_transform(win)
 
-        aoi_geojson = [mapping(aoi_src)]
-        outside = geometry_mask(
-            aoi_geojson,
-            out_shape=(data.shape[0], data.shape[1]),
-            transform=win_transform,
-            invert=False,
-            all_touched=all_touched,
-        )
+        if aoi_src.contains(box(*rasterio.windows.bounds(win, src.transform))):
+            # interior tile, nothing to rasterize
+            outside = np.zeros(data.shape, dtype=bool)
+        else:
+            aoi_geojson = [mapping(aoi_src)]
+            outside = geometry_mask(
+                aoi_geojson,
+                out_shape=(data.shape[0], data.shape[1]),
+                transform=win_transform,
+                invert=False,
+                all_touched=all_touched,
+            )
 
         nodata = src.nodata
         if nodata is None:
             nodata = -9999.0 if np.issubdtype(data.dtype, np.floating) else -9999
 
-        masked = np.ma.array(data, mask=np.ma.getmaskarray(data) | outside)
-        out_arr = masked.filled(nodata)
+        mask = np.ma.getmaskarray(data) | outside
 
-        if np.all(out_arr == nodata):
+        # pixels equal to nodata are already masked by the read, so an all-nodata
+        # output is exactly a fully masked window
+        if mask.all():
             return None
 
+        out_arr = np.where(mask, np.asarray(nodata, dtype=data.dtype), data.data)
+
         profile = src.profile.copy()
         profile.update(
             driver="GTiff",
@@ -114,29 +147,25 @@ def mosaic_clipped_tifs(
     srcs = [rasterio.open(p) for p in clipped_paths]
 
     try:
-        mosaic_arr, mosaic_transform = merge(
+        # writing through dst_path lets rasterio merge window by window
+        # instead of materializing the whole mosaic in memory
+        merge(
             srcs,
             resampling=Resampling.nearest,
-        )
-
-        profile = srcs[0].profile.copy()
-        profile.update(
-            {
+            mem_limit=256,
+            dst_path=out_path,
+            dst_kwds={
                 "driver": "GTiff",
-                "height": mosaic_arr.shape[1],
-                "width": mosaic_arr.shape[2],
-                "transform": mosaic_transform,
-                "count": mosaic_arr.shape[0],
                 "compress": "deflate",
                 "tiled": True,
+                "blockxsize": 512,
+                "blockysize": 512,
                 "predictor": 3,
+                "num_threads": "all_cpus",
                 "BIGTIFF": "IF_SAFER",
-            }
+            },
         )
 
-        with rasterio.open(out_path, "w", **profile) as dst:
-            dst.write(mosaic_arr)
-
         return str(out_path)
 
     finally:
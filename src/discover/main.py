@@ -1,22 +1,34 @@
 import argparse
-import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Dict, List, Optional, Set, Tuple
+from itertools import batched
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+import orjson
 from geoalchemy2.shape import to_shape
-from shapely import MultiPolygon
+from shapely import STRtree, area, intersection, prepare, within
 from shapely.geometry import shape
 
 from src.controller.project import ProjectController
 from src.controller.scene import SceneController
 from src.utils.config import load_project_config
+from src.utils.geo import GlacierIndex, build_glacier_index
 from src.utils.logger import get_logger
-from src.utils.models import Glacier, Scene
+from src.utils.models import Scene
 from src.utils.stac import Stac
 
 logger = get_logger("glacier_watch.discover")
 
+DISCOVER_BATCH_SIZE = 500
+
+# coverage process pool size, and the number of intersecting scenes in a batch
+# below which coverage is computed inline instead
+COVERAGE_WORKERS = 4
+COVERAGE_POOL_MIN_SCENES = 16
+
 
 @dataclass
 class Args:
@@ -79,28 +91,60 @@ def filter_existing_scenes(scene_ids: Set[str]) -> Set[str]:
     scene_ids: list of scene IDs to check
     Returns a set of existing scene IDs.
     """
-    existing_scenes = SceneController.get_scenes_by_ids(scene_ids)
-    existing_scene_ids = {scene.scene_id for scene in existing_scenes}
+    existing_scene_ids = SceneController.get_existing_scene_ids(scene_ids)
 
     return scene_ids - existing_scene_ids
 
 
-def filter_not_intersecting_scenes(scene_geometry, aoi_geometry, scene_id) -> bool:
+def bbox_intersects(bbox: Optional[List[float]], bounds: Tuple[float, ...]) -> bool:
     """
-    Check if the scene geometry intersects with the AOI geometry.
+    Check if a STAC item bbox can intersect the given bounds.
 
-    scene_geometry: shapely geometry of the scene
+    bbox: item bbox as [minx, miny, maxx, maxy] or the 3D
+        [minx, miny, minz, maxx, maxy, maxz], or None if the item has none
+    bounds: (minx, miny, maxx, maxy) of the AOI
+    Returns False only if the boxes are disjoint.
+    """
+    if not bbox:
+        return True
+
+    # 3D bboxes list all minimums before the maximums
+    half = len(bbox) // 2
+    minx, miny, maxx, maxy = *bbox[:2], *bbox[half : half + 2]
+
+    return not (
+        maxx < bounds[0] or minx > bounds[2] or maxy < bounds[1] or miny > bounds[3]
+    )
+
+
+def filter_intersecting_scenes(
+    scene_ids: List[str], scene_geometries: List, aoi_geometry
+) -> Set[int]:
+    """
+    Check which scene geometries intersect with the AOI geometry.
+
+    scene_ids: list of scene IDs, parallel to scene_geometries
+    scene_geometries: list of shapely geometries of the scenes, None for scenes
+        already known to miss the AOI
     aoi_geometry: shapely geometry of the AOI
-    Returns True if they intersect, False otherwise.
+    Returns the set of indices of the scenes intersecting the AOI.
     """
-    if not aoi_geometry.within(scene_geometry):
-        logger.warning(f"Scene {scene_id} does not fully cover the AOI. Skipping.")
+    tree = STRtree(scene_geometries)
 
-    if not aoi_geometry.intersects(scene_geometry):
-        logger.warning(f"Scene {scene_id} does not intersect the AOI. Skipping.")
-        return False
+    hits = tree.query(aoi_geometry, predicate="intersects")
+    # a covering scene always intersects, only test the hits instead of
+    # running a second query over the whole tree
+    covering = set(hits[within(aoi_geometry, tree.geometries[hits])].tolist())
+    intersecting = set(hits.tolist())
 
-    return True
+    for index, scene_id in enumerate(scene_ids):
+        if index not in covering:
+            logger.warning(f"Scene {scene_id} does not fully cover the AOI. Skipping.")
+
+        if index not in intersecting:
+            logger.warning(f"Scene {scene_id} does not intersect the AOI. Skipping.")
+
+    return intersecting
 
 
 def calculate_aoi_coverage(scene_geometry, aoi_geometry) -> float:
@@ -119,31 +163,53 @@ def calculate_aoi_coverage(scene_geometry, aoi_geometry) -> float:
 
 
 def calculate_glaciers_coverage(
-    scene_geometry, glaciers: List[Glacier]
+    scene_geometry, glacier_index: GlacierIndex
 ) -> List[Tuple[str, float]]:
     """
     Calculate the coverage of each glacier by the scene geometry.
 
     scene_geometry: shapely geometry of the scene
-    glaciers: list of Glacier objects
+    glacier_index: GlacierIndex of the project glaciers
     Returns a list of tuples (glacier_name, coverage_percentage).
     """
 
-    glacier_coverages = []
+    candidates = glacier_index.query(scene_geometry)
 
-    for glacier in glaciers:
-        if not glacier.name or not glacier.geometry:
-            # skip unnamed glaciers or glaciers without geometry
-            continue
+    intersection_areas = area(
+        intersection(glacier_index.geometries[candidates], scene_geometry)
+    )
+    coverages = intersection_areas / glacier_index.areas[candidates] * 100
 
-        glacier_geometry = to_shape(glacier.geometry)
-        if scene_geometry.intersects(glacier_geometry):
-            intersection_area = scene_geometry.intersection(glacier_geometry).area
-            glacier_area = glacier_geometry.area
-            glacier_coverage = intersection_area / glacier_area * 100
-            glacier_coverages.append((glacier.name, glacier_coverage))
+    return list(zip(glacier_index.names[candidates].tolist(), coverages.tolist()))
 
-    return glacier_coverages
+
+# per-process coverage state, set up in the main process for inline coverage and
+# in each pool worker, since prepared geometries and STRtrees can't be pickled
+_worker_aoi_geometry = None
+_worker_glacier_index: Optional[GlacierIndex] = None
+
+
+def init_coverage_worker(aoi_geometry, glacier_names: List[str], glacier_wkbs: List):
+    global _worker_aoi_geometry, _worker_glacier_index
+
+    prepare(aoi_geometry)
+    _worker_aoi_geometry = aoi_geometry
+    _worker_glacier_index = build_glacier_index(glacier_names, glacier_wkbs)
+
+
+def calculate_scene_coverage(scene_geometry) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Calculate the AOI and glacier coverage of a scene in a coverage worker.
+
+    scene_geometry: shapely geometry of the scene
+    Returns a tuple (aoi_coverage_percentage, glacier_coverages).
+    """
+    aoi_coverage = calculate_aoi_coverage(scene_geometry, _worker_aoi_geometry)
+    glacier_coverages = calculate_glaciers_coverage(
+        scene_geometry, _worker_glacier_index
+    )
+
+    return aoi_coverage, glacier_coverages
 
 
 def get_scene_from_stac_item(
@@ -158,38 +224,39 @@ def get_scene_from_stac_item(
     """
     props = item.properties
 
-    logger.debug(f"Scene {scene_id} properties: {props}")
+    # %-style so the properties and assets are only formatted at debug level
+    logger.debug("Scene %s properties: %s", scene_id, props)
 
-    logger.debug(f"Scene {scene_id} assets: {item.assets}")
+    logger.debug("Scene %s assets: %s", scene_id, item.assets)
 
     items = {
         asset_key: Stac.parse_asset_href(asset)
         for asset_key, asset in item.assets.items()
         if asset_key in project_config["bands"]
     }
-    logger.info(f"Assets to download: {items}")
+    logger.info("Assets to download: %s", items)
 
     return Scene(
         scene_id=scene_id,
         project_id=project_id,
-        stac_href=json.dumps(items),
+        stac_href=orjson.dumps(items).decode(),
         acquisition_date=props.get("datetime"),
         status="queued_for_download",
     )
 
 
-def save_scenes(scenes: List[Scene], dry_run: bool):
+def save_scenes(scenes: Iterable[Scene], dry_run: bool):
     """
     Save discovered scenes to the database or to a JSON file in dry run mode.
 
-    scenes: list of Scene objects to save
-    dry_run: if True, save to JSON file instead of database
+    scenes: Scene objects to save, consumed once
+    dry_run: if True, write newline-delimited JSON instead of saving to the database
     """
     if dry_run:
-        with open("scratch/discovered_scenes.json", "w") as f:
-            json.dump(
-                {
-                    "scenes": [
+        with open("scratch/discovered_scenes.ndjson", "wb") as f:
+            for scene in scenes:
+                f.write(
+                    orjson.dumps(
                         {
                             "scene_id": scene.scene_id,
                             "project_id": scene.project_id,
@@ -197,110 +264,159 @@ def save_scenes(scenes: List[Scene], dry_run: bool):
                             "acquisition_date": scene.acquisition_date,
                             "status": scene.status,
                         }
-                        for scene in scenes
-                    ]
-                },
-                f,
-                indent=4,
-            )
-    else:
-        SceneController.add_scenes(scenes)
-
-
-def main(args: Args):
-    logger = get_logger("glacier_watch.discover", args.log_level)
-
-    project_config = load_project_config(args.project_id)
-
-    logger.info(
-        f"Discovering scenes for project {args.project_id} from {args.date_from} to {args.date_to}"
-    )
-
-    stac = Stac(logger=logger)
-
-    project = ProjectController.get_project_by_id(args.project_id)
-
-    if not project:
-        logger.error(f"Project {args.project_id} not found.")
-        raise ValueError(f"Project {args.project_id} not found.")
-
-    aoi_geometry = MultiPolygon(to_shape(project.area_of_interest))
-
-    logger.info(f"Using project AOI: {aoi_geometry.wkt}")
-
-    files = stac.search_sentinel2_data(
-        polygon=aoi_geometry,
-        date_from=args.date_from,
-        date_to=args.date_to,
-    )
-
-    logger.info(f"Found {len(files)} scenes from STAC API.")
-
-    scenes = []
-
-    if args.dry_run:
-        new_scene_ids = {scene.id for scene in files}
+                    )
+                    + b"\n"
+                )
     else:
-        new_scene_ids = filter_existing_scenes({scene.id for scene in files})
-
-    files = [scene for scene in files if scene.id in new_scene_ids]
-
-    logger.info(f"{len(files)} new scenes to process after filtering existing scenes.")
+        SceneController.add_scenes(list(scenes))
+
+
+def discover_new_scenes(
+    args: Args,
+    project,
+    project_config,
+    files: Iterable,
+    aoi_geometry,
+    glacier_names: List[str],
+    glacier_wkbs: List,
+) -> Iterator[Scene]:
+    """
+    Yield a Scene for every new STAC item that covers glaciers of the project,
+    batch by batch as the search is paged.
+
+    args: discover arguments, for the dry run flag and the scene limit
+    project: Project the scenes are discovered for
+    project_config: configuration of the project
+    files: STAC items of the search
+    aoi_geometry: prepared shapely geometry of the project AOI
+    glacier_names: names of the project glaciers
+    glacier_wkbs: WKB geometries of the project glaciers
+    """
+    aoi_bounds = aoi_geometry.bounds
 
     count = 0
-
-    project_glaciers = ProjectController.get_glaciers_in_project(project.project_id)
+    found_count = 0
 
     coverage_by_scene = {}
 
-    for scene_info in files:
-        try:
-            scene_id = scene_info.id
+    # coverage is GEOS bound and independent per scene. Large batches are spread
+    # over a process pool started on first use, small ones are computed inline
+    init_coverage_worker(aoi_geometry, glacier_names, glacier_wkbs)
+    executor = None
+    try:
+        # the search is paged lazily, handle it in batches so only one batch of
+        # items is held in memory and the existence check is one query per batch
+        for batch in batched(files, DISCOVER_BATCH_SIZE):
+            found_count += len(batch)
 
-            coverage_by_scene[scene_id] = {}
-            scene_geometry = shape(scene_info.geometry)
+            if args.dry_run:
+                new_scene_ids = {scene.id for scene in batch}
+            else:
+                new_scene_ids = filter_existing_scenes({scene.id for scene in batch})
 
-            if not filter_not_intersecting_scenes(
-                scene_geometry, aoi_geometry, scene_id
-            ):
-                continue
+            batch = [scene for scene in batch if scene.id in new_scene_ids]
 
-            aoi_coverage = calculate_aoi_coverage(scene_geometry, aoi_geometry)
+            logger.info(
+                f"{len(batch)} new scenes to process after filtering existing scenes."
+            )
 
-            coverage_by_scene[scene_id]["aoi_coverage_percent"] = aoi_coverage
+            valid_batch = []
+            scene_geometries = []
+            for scene_info in batch:
+                try:
+                    # cheap bbox check first, only build footprints that can intersect
+                    scene_geometry = (
+                        shape(scene_info.geometry)
+                        if bbox_intersects(scene_info.bbox, aoi_bounds)
+                        else None
+                    )
+                except Exception as e:
+                    logger.error(f"Error processing scene {scene_info.id}: {e}")
+                    continue
+
+                valid_batch.append(scene_info)
+                scene_geometries.append(scene_geometry)
 
-            glacier_coverages = calculate_glaciers_coverage(
-                scene_geometry, project_glaciers
+            batch = valid_batch
+            scene_ids = [scene_info.id for scene_info in batch]
+
+            intersecting = filter_intersecting_scenes(
+                scene_ids, scene_geometries, aoi_geometry
             )
 
-            if glacier_coverages:
-                for glacier_name, glacier_coverage in glacier_coverages:
-                    logger.debug(
-                        f"Scene {scene_id} covers {glacier_coverage:.2f}% of glacier {glacier_name}."
+            coverage_futures = {}
+            if len(intersecting) >= COVERAGE_POOL_MIN_SCENES:
+                if executor is None:
+                    # forkserver workers don't inherit the open database connections
+                    executor = ProcessPoolExecutor(
+                        max_workers=COVERAGE_WORKERS,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                        initializer=init_coverage_worker,
+                        initargs=(aoi_geometry, glacier_names, glacier_wkbs),
+                    )
+                coverage_futures = {
+                    index: executor.submit(
+                        calculate_scene_coverage, scene_geometries[index]
+                    )
+                    for index in intersecting
+                }
+
+            for index, (scene_info, scene_id) in enumerate(zip(batch, scene_ids)):
+                try:
+                    coverage_by_scene[scene_id] = {}
+
+                    if index not in intersecting:
+                        continue
+
+                    if index in coverage_futures:
+                        scene_coverage = coverage_futures[index].result()
+                    else:
+                        scene_coverage = calculate_scene_coverage(
+                            scene_geometries[index]
+                        )
+                    aoi_coverage, glacier_coverages = scene_coverage
+
+                    coverage_by_scene[scene_id]["aoi_coverage_percent"] = aoi_coverage
+
+                    if glacier_coverages:
+                        if logger.isEnabledFor(logging.DEBUG):
+                            for glacier_name, glacier_coverage in glacier_coverages:
+                                logger.debug(
+                                    f"Scene {scene_id} covers {glacier_coverage:.2f}% of glacier {glacier_name}."
+                                )
+                        coverage_by_scene[scene_id]["glaciers"] = glacier_coverages
+                    else:
+                        logger.info(
+                            f"Scene {scene_id} does not cover any glaciers in the project."
+                        )
+                        continue
+
+                    new_scene = get_scene_from_stac_item(
+                        item=scene_info,
+                        scene_id=scene_id,
+                        project_id=project.project_id,
+                        project_config=project_config,
                     )
-                coverage_by_scene[scene_id]["glaciers"] = glacier_coverages
-            else:
-                logger.info(
-                    f"Scene {scene_id} does not cover any glaciers in the project."
-                )
-                continue
 
-            new_scene = get_scene_from_stac_item(
-                item=scene_info,
-                scene_id=scene_id,
-                project_id=project.project_id,
-                project_config=project_config,
-            )
+                    yield new_scene
+                    logger.info(f"Added scene {scene_id} to the database.")
 
-            scenes.append(new_scene)
-            logger.info(f"Added scene {scene_id} to the database.")
+                    count += 1
+                    if args.limit and count >= args.limit:
+                        break
+                except Exception as e:
+                    logger.error(f"Error processing scene {scene_info.id}: {e}")
+                    continue
 
-            count += 1
             if args.limit and count >= args.limit:
+                for future in coverage_futures.values():
+                    future.cancel()
                 break
-        except Exception as e:
-            logger.error(f"Error processing scene {scene_info.id}: {e}")
-            continue
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    logger.info(f"Found {found_count} scenes from STAC API.")
 
     # TODO: save this coverage data for later? use it for downloading or processing prioritization?
     logger.info("Coverage summary by scene:")
@@ -311,9 +427,53 @@ def main(args: Args):
         for glacier_name, glacier_coverage in glaciers:
             logger.info(f"  Glacier {glacier_name} coverage: {glacier_coverage:.2f}%")
 
-    logger.info(f"Total new scenes to add: {len(scenes)}")
-    logger.debug(f"Scenes: {[scene.scene_id for scene in scenes]}")
+    logger.info(f"Total new scenes to add: {count}")
+
+
+def main(args: Args):
+    logger = get_logger("glacier_watch.discover", args.log_level)
 
+    project_config = load_project_config(args.project_id)
+
+    logger.info(
+        f"Discovering scenes for project {args.project_id} from {args.date_from} to {args.date_to}"
+    )
+
+    stac = Stac(logger=logger)
+
+    project = ProjectController.get_project_by_id(args.project_id)
+
+    if not project:
+        logger.error(f"Project {args.project_id} not found.")
+        raise ValueError(f"Project {args.project_id} not found.")
+
+    # the column is typed MULTIPOLYGON, no need to rebuild the geometry
+    aoi_geometry = to_shape(project.area_of_interest)
+    # the AOI is tested against every scene, build its GEOS index once
+    prepare(aoi_geometry)
+
+    logger.info(f"Using project AOI: {aoi_geometry.wkt}")
+
+    files = stac.search_sentinel2_data(
+        polygon=aoi_geometry,
+        date_from=args.date_from,
+        date_to=args.date_to,
+    )
+
+    glacier_names, glacier_wkbs = ProjectController.get_glacier_geometries_in_project(
+        project.project_id
+    )
+
+    # scenes are written out as they are discovered
+    scenes = discover_new_scenes(
+        args,
+        project,
+        project_config,
+        files,
+        aoi_geometry,
+        glacier_names,
+        glacier_wkbs,
+    )
     save_scenes(scenes, dry_run=args.dry_run)
 
 
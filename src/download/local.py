@@ -2,7 +2,8 @@ import argparse
 from dataclasses import dataclass
 
 from src.controller.scene import SceneController
-from src.download.main import download_item_assets, prepare_folder
+from src.download.main import download_item_assets
+from src.utils.file import prepare_folder
 from src.utils.logger import add_log_context, get_logger
 from src.utils.stac import Stac
 
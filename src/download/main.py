@@ -1,7 +1,9 @@
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from time import sleep
 
+import orjson
+
 from src.controller.scene import SceneController
 from src.utils.file import prepare_folder
 from src.utils.logger import add_log_context, get_logger
@@ -10,18 +12,44 @@ from src.utils.stac import Stac
 
 logger = get_logger("glacier_watch.download")
 
+DOWNLOAD_WORKERS = 4
+
 
 def download_item_assets(stac: Stac, stac_href: str, download_path: Path):
-    items = json.loads(stac_href)
+    items = orjson.loads(stac_href)
+
+    # fetch the token up front so the worker threads share it
+    stac.get_cdse_token()
 
-    for band_name, href in items.items():
+    def download_band(band_name: str, href: str):
         logger.info(f"Downloading asset {band_name} from {href} to {download_path}")
         stac.download_item_assets(
             asset_href=href, download_path=download_path / f"{band_name}.jp2"
         )
 
+    errors = []
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(DOWNLOAD_WORKERS, len(items)))
+    ) as executor:
+        futures = {
+            executor.submit(download_band, band_name, href): band_name
+            for band_name, href in items.items()
+        }
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed to download asset {futures[future]}: {e}")
+                errors.append(e)
+
+    if errors:
+        raise errors[0]
+
 
 def download_scene(stac: Stac) -> bool:
+    scene = None
     try:
         scene = SceneController.lock_and_get_scene(
             SceneStatusEnum.queued_for_download, SceneStatusEnum.downloading, logger
@@ -54,9 +82,10 @@ def download_scene(stac: Stac) -> bool:
         return True
     except Exception as e:
         logger.error(f"Error downloading scene: {e}")
-        SceneController.update_scene_status(
-            scene, SceneStatusEnum.failed_download, error_message=str(e)
-        )
+        if scene is not None:
+            SceneController.update_scene_status(
+                scene, SceneStatusEnum.failed_download, error_message=str(e)
+            )
 
 
 if __name__ == "__main__":
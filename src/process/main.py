@@ -1,24 +1,28 @@
+import hashlib
+import os
 from argparse import ArgumentParser
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from time import sleep
 from typing import Dict, List, Literal, Optional, Tuple
 
+import numpy as np
+import shapely
+import xarray as xr
 from geoalchemy2.shape import to_shape
 from pyproj import CRS
-from rasterio.warp import transform_geom
-from shapely import MultiPolygon, box
-from shapely.geometry import shape
-from shapely.ops import unary_union
+from rioxarray.exceptions import NoDataInBounds
+from shapely import MultiPolygon
 
 from src.controller.project import ProjectController
 from src.controller.scene import SceneController
 from src.process.processing import (
-    analyze_glacier_snow_area,
-    clip_raster,
+    analyze_glaciers_snow_area,
     compute_ndsi,
     create_mask,
+    rasterize_clip_mask,
     stack_bands,
 )
 from src.utils.config import load_project_config
@@ -28,7 +32,9 @@ from src.utils.file import (
     load_raster,
     prepare_folder,
     prepare_temp_folder,
+    save_raster,
 )
+from src.utils.geo import reproject_geoms
 from src.utils.logger import add_log_context, get_logger
 from src.utils.models import Glacier, GlaciersAnalysisResult, Scene, SceneStatusEnum
 
@@ -36,6 +42,11 @@ logger = get_logger("glacier_watch.process")
 
 PROJECT_CRS = CRS.from_epsg(4326)
 
+CLIP_WORKERS = 4
+
+# aligned DEMs kept per project, the least recently used ones are removed
+ALIGNED_DEM_CACHE_SIZE = 8
+
 
 @dataclass
 class Args:
@@ -124,41 +135,131 @@ def get_scene_glaciers(
     raster = load_raster(raster_path)
     crs = raster.rio.crs
 
-    transformed_glaciers = [
-        (
-            glacier.glacier_id,
-            transform_geom(
-                PROJECT_CRS.to_string(),
-                crs.to_string(),
-                geom=to_shape(glacier.geometry).__geo_interface__,
-            ),
-        )
-        for glacier in glaciers
-    ]
+    glacier_shps = reproject_geoms(
+        [to_shape(glacier.geometry) for glacier in glaciers],
+        PROJECT_CRS.to_string(),
+        crs.to_string(),
+    )
+    minx, miny, maxx, maxy = raster.rio.bounds()
+
+    # a geometry is within an axis aligned box exactly when its envelope is, so
+    # comparing the bounds of all glaciers at once replaces the GEOS predicate
+    glacier_bounds = shapely.bounds(glacier_shps)
+    candidates = np.flatnonzero(
+        (glacier_bounds[:, 0] >= minx)
+        & (glacier_bounds[:, 1] >= miny)
+        & (glacier_bounds[:, 2] <= maxx)
+        & (glacier_bounds[:, 3] <= maxy)
+    )
 
-    raster_bounds_geom = box(*raster.rio.bounds())
     filtered_glaciers = []
-    for glacier_id, glacier_geom in transformed_glaciers:
-        glacier_shp = MultiPolygon(shape(glacier_geom))
+    for index in candidates:
+        glacier_shp = glacier_shps[index]
+
+        # most outlines are stored as multipolygons already, only wrap the rest
+        if glacier_shp.geom_type != "MultiPolygon":
+            glacier_shp = MultiPolygon([glacier_shp])
 
-        if glacier_shp.within(raster_bounds_geom):
-            filtered_glaciers.append((glacier_id, glacier_shp))
+        filtered_glaciers.append((glaciers[index].glacier_id, glacier_shp))
 
     return filtered_glaciers
 
 
 def clip_rasters_to_glaciers(
-    raster_in_path: Path, raster_out_path: Path, glaciers_geom: MultiPolygon
+    raster_in_path: Path,
+    raster_out_path: Path,
+    glaciers_geom: MultiPolygon,
+    clip_masks: Dict,
 ):
-    raster = load_raster(raster_in_path)
+    # bands are clipped concurrently, so skip rasterio's global read lock
+    raster = load_raster(raster_in_path, lock=False)
 
-    crs = raster.rio.crs
+    # bands on the same grid share one rasterized mask, two threads may both
+    # rasterize it the first time but they produce the same result
+    grid = (raster.rio.transform(), raster.rio.shape)
+    if grid not in clip_masks:
+        clip_masks[grid] = rasterize_clip_mask(glaciers_geom, *grid)
+    (rows, cols), inside = clip_masks[grid]
 
-    clipped_raster = clip_raster(raster, glaciers_geom, crs)
+    # the band is opened lazily, so only the window around the glaciers is decoded
+    clipped_raster = raster.isel(y=rows, x=cols)
+    clipped_raster = clipped_raster.where(xr.DataArray(inside, dims=("y", "x")))
+    clipped_raster.encoding = raster.encoding.copy()
 
     clipped_raster.rio.to_raster(raster_out_path)
 
 
+def load_aligned_dem(dem_file_path: Path, target: xr.DataArray) -> xr.DataArray:
+    """
+    Load the DEM reprojected onto the grid of the target raster. The aligned DEM is
+    cached next to the project DEM, keyed by the target grid, so scenes on the same
+    grid only warp it once. At most ALIGNED_DEM_CACHE_SIZE aligned DEMs are kept.
+
+    :param dem_file_path: Path of the project DEM
+    :param target: Raster whose grid the DEM is aligned to
+    :return: The DEM on the target grid
+    """
+    grid = (
+        target.rio.crs.to_string(),
+        tuple(target.rio.transform()),
+        target.rio.shape,
+    )
+    grid_hash = hashlib.sha1(repr(grid).encode()).hexdigest()[:16]
+    aligned_path = dem_file_path.with_name(f"dem_aligned_{grid_hash}.tif")
+
+    if (
+        aligned_path.is_file()
+        and aligned_path.stat().st_mtime >= dem_file_path.stat().st_mtime
+    ):
+        logger.info(f"Using cached aligned DEM {aligned_path}")
+        # mark it as recently used for the cache eviction
+        os.utime(aligned_path)
+        return load_raster(aligned_path)
+
+    dem = load_raster(dem_file_path)
+
+    # only read the part of the DEM under the clipped scene before reprojecting
+    try:
+        clipped_dem = dem.rio.clip_box(
+            *target.rio.bounds(), crs=target.rio.crs, auto_expand=True
+        )
+    except NoDataInBounds:
+        # no overlap, reprojecting the whole DEM gives the all-nodata grid
+        logger.warning(f"DEM {dem_file_path} does not overlap the scene grid.")
+        clipped_dem = dem
+    dem = clipped_dem.rio.reproject_match(target)
+
+    # write under a temporary name so a concurrent run never reads a partial file
+    temp_path = aligned_path.with_suffix(f".{os.getpid()}.tmp")
+    dem.rio.to_raster(temp_path, driver="GTiff", tiled=True, compress="deflate")
+    os.replace(temp_path, aligned_path)
+
+    evict_aligned_dems(dem_file_path)
+
+    return dem
+
+
+def evict_aligned_dems(dem_file_path: Path):
+    """
+    Remove the least recently used aligned DEMs next to the project DEM, keeping
+    ALIGNED_DEM_CACHE_SIZE of them.
+
+    :param dem_file_path: Path of the project DEM
+    """
+    cached = []
+    for path in dem_file_path.parent.glob("dem_aligned_*.tif"):
+        try:
+            cached.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # removed by a concurrent run
+            continue
+
+    cached.sort(reverse=True)
+    for _, path in cached[ALIGNED_DEM_CACHE_SIZE:]:
+        logger.info(f"Removing aligned DEM {path} from the cache")
+        path.unlink(missing_ok=True)
+
+
 def get_band_path(project_bands: Dict[str, Path], band_name: str) -> Optional[Path]:
     """
     Get the file path for a specific band from the project bands dictionary. As band resolutions may vary, it matches the start of the band name.
@@ -177,6 +278,10 @@ def get_band_path(project_bands: Dict[str, Path], band_name: str) -> Optional[Pa
 
 
 def main(args: Args) -> Literal["success", "failure", "no_scene"]:
+    # result rasters are written in the background while the analysis continues
+    io_pool = ThreadPoolExecutor(max_workers=2)
+    result_writes: Dict[Path, Future] = {}
+
     try:
         scene = lock_and_get_scene(args.dry_run, args.scene_id)
 
@@ -202,25 +307,37 @@ def main(args: Args) -> Literal["success", "failure", "no_scene"]:
             project_glaciers, list(project_bands.values())[0]
         )
 
-        glacier_geometries = unary_union(
-            [glacier_geom for _, glacier_geom in filtered_glaciers]
+        # simplify and buffer every glacier outline on its own and merge the
+        # buffers, which keeps far fewer vertices than buffering the full union.
+        # The 10 m tolerance is well inside the 200 m buffer
+        glacier_geometries = [glacier_geom for _, glacier_geom in filtered_glaciers]
+        buffered_glacier_geometries = shapely.union_all(
+            shapely.buffer(shapely.simplify(glacier_geometries, 10), 200, quad_segs=4)
         )
-        buffered_glacier_geometries = glacier_geometries.buffer(200)
 
         clipped_bands = {}
+        clip_masks = {}
 
         prepare_temp_folder()
 
-        for band_name, file_path in project_bands.items():
-            output_path = Path("data/temp") / file_path.name
-
-            clip_rasters_to_glaciers(
-                raster_in_path=file_path,
-                raster_out_path=output_path,
-                glaciers_geom=buffered_glacier_geometries,
-            )
+        # each band is read and written on its own thread, rasterio releases the
+        # GIL while GDAL decodes the window
+        with ThreadPoolExecutor(max_workers=CLIP_WORKERS) as clip_pool:
+            clip_futures = {}
+            for band_name, file_path in project_bands.items():
+                output_path = Path("data/temp") / file_path.name
+
+                clip_futures[band_name] = clip_pool.submit(
+                    clip_rasters_to_glaciers,
+                    raster_in_path=file_path,
+                    raster_out_path=output_path,
+                    glaciers_geom=buffered_glacier_geometries,
+                    clip_masks=clip_masks,
+                )
+                clipped_bands[band_name] = output_path
 
-            clipped_bands[band_name] = output_path
+            for clip_future in clip_futures.values():
+                clip_future.result()
 
         results_folder_path = prepare_folder(
             project_id=scene.project_id, scene_id=scene.scene_id, folder_type="result"
@@ -228,33 +345,33 @@ def main(args: Args) -> Literal["success", "failure", "no_scene"]:
 
         logger.info("Processing clipped bands to compute results.")
 
+        # open every band once, B03 is used both for the true color image and NDSI
+        band_rasters = {
+            band_name: load_raster(get_band_path(clipped_bands, band_name))
+            for band_name in ["B04", "B03", "B02", "B11"]
+        }
+
         rgb_stacked = stack_bands(
-            [
-                load_raster(get_band_path(clipped_bands, band_name))
-                for band_name in ["B04", "B03", "B02"]
-            ]
+            [band_rasters[band_name] for band_name in ["B04", "B03", "B02"]]
         ).assign_coords(band=["red", "green", "blue"])
 
-        rgb_stacked.rio.to_raster(results_folder_path / "true_color.tif")
-
-        logger.info(
-            f"RGB true color image saved to {results_folder_path / 'true_color.tif'}"
+        true_color_path = results_folder_path / "true_color.tif"
+        result_writes[true_color_path] = io_pool.submit(
+            save_raster, rgb_stacked, true_color_path
         )
 
         ndsi = compute_ndsi(
-            band_swir=load_raster(get_band_path(clipped_bands, "B11")),
-            band_green=load_raster(get_band_path(clipped_bands, "B03")),
+            band_swir=band_rasters["B11"],
+            band_green=band_rasters["B03"],
         )
 
-        ndsi.rio.to_raster(results_folder_path / "ndsi.tif")
-
-        logger.info(f"NDSI raster saved to {results_folder_path / 'ndsi.tif'}")
+        ndsi_path = results_folder_path / "ndsi.tif"
+        result_writes[ndsi_path] = io_pool.submit(save_raster, ndsi, ndsi_path)
 
         ndsi_mask = create_mask(ndsi, threshold=0.4)
-        ndsi_mask.rio.to_raster(results_folder_path / "ndsi_mask.tif")
-
-        logger.info(
-            f"NDSI mask raster saved to {results_folder_path / 'ndsi_mask.tif'}"
+        ndsi_mask_path = results_folder_path / "ndsi_mask.tif"
+        result_writes[ndsi_mask_path] = io_pool.submit(
+            save_raster, ndsi_mask, ndsi_mask_path
         )
 
         transform = ndsi_mask.rio.transform()
@@ -262,11 +379,8 @@ def main(args: Args) -> Literal["success", "failure", "no_scene"]:
         pixel_h = -transform.e
         pixel_area = pixel_w * pixel_h
 
-        dem = load_raster(dem_file_path)
-
-        dem = dem.rio.reproject_match(ndsi_mask)
+        dem = load_aligned_dem(dem_file_path, ndsi_mask)
 
-        analysis_results = []
         now = datetime.now()
 
         analyis = GlaciersAnalysisResult(
@@ -277,25 +391,24 @@ def main(args: Args) -> Literal["success", "failure", "no_scene"]:
             total_glacier_snow_area_m2=0.0,
         )
 
-        for glacier_id, glacier_geom in filtered_glaciers:
-            try:
-                glacier_snow_data = analyze_glacier_snow_area(
-                    glacier_id=glacier_id,
-                    glacier_geom=glacier_geom,
-                    dem=dem,
-                    ndsi_mask=ndsi_mask,
-                    pixel_area=pixel_area,
-                    scene_id=scene.scene_id,
-                    analysis_id=analyis.id,
-                )
-
-                analyis.snow_area_m2 += glacier_snow_data.snow_area_m2
-                analysis_results.append(glacier_snow_data)
-            except Exception as e:
-                logger.warning(f"Error processing glacier {glacier_id}: {e}. Skipping.")
-                continue
+        analysis_results = analyze_glaciers_snow_area(
+            glaciers=filtered_glaciers,
+            dem=dem,
+            ndsi_mask=ndsi_mask,
+            pixel_area=pixel_area,
+            scene_id=scene.scene_id,
+            analysis_id=analyis.id,
+        )
+        analyis.snow_area_m2 = sum(
+            glacier_data.snow_area_m2 for glacier_data in analysis_results
+        )
         analyis.total_glacier_snow_area_m2 = analyis.snow_area_m2
 
+        # the scene only counts as processed once every result raster is on disk
+        for result_path, result_write in result_writes.items():
+            result_write.result()
+            logger.info(f"Result raster saved to {result_path}")
+
         if not args.dry_run:
             with get_session() as session:
                 session.add(analyis)
@@ -335,6 +448,9 @@ def main(args: Args) -> Literal["success", "failure", "no_scene"]:
         cleanup_temp_folder()
         return "failure"
 
+    finally:
+        io_pool.shutdown(wait=True)
+
 
 if __name__ == "__main__":
     args = parse_args()
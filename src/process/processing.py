@@ -1,7 +1,11 @@
 from datetime import datetime
+from typing import List, Tuple
 
 import numpy as np
 import xarray as xr
+from affine import Affine
+from rasterio.enums import MergeAlg
+from rasterio.features import geometry_mask, rasterize
 from shapely import MultiPolygon
 
 from src.utils.logger import get_logger
@@ -9,64 +13,267 @@ from src.utils.models import GlacierSnowData
 
 logger = get_logger("glacier_watch.process")
 
+MASK_NODATA = 255
 
-def clip_raster(raster: xr.DataArray, geometry, crs: str) -> xr.DataArray:
-    clipped = raster.rio.clip(
+
+def _pixel_window(
+    bounds, transform: Affine, shape: Tuple[int, int]
+) -> Tuple[int, int, int, int]:
+    """
+    Pixel window of the grid covering bounds, padded by a pixel on each side.
+
+    bounds: (minx, miny, maxx, maxy) in the CRS of the grid
+    transform: affine transform of the grid
+    shape: (height, width) of the grid
+    Returns (row_start, row_stop, col_start, col_stop), clamped to the grid.
+    """
+    height, width = shape
+    minx, miny, maxx, maxy = bounds
+
+    left, top = ~transform * (minx, maxy)
+    right, bottom = ~transform * (maxx, miny)
+    row_start = max(int(np.floor(min(top, bottom))) - 1, 0)
+    row_stop = min(int(np.ceil(max(top, bottom))) + 1, height)
+    col_start = max(int(np.floor(min(left, right))) - 1, 0)
+    col_stop = min(int(np.ceil(max(left, right))) + 1, width)
+
+    return row_start, row_stop, col_start, col_stop
+
+
+def rasterize_clip_mask(
+    geometry, transform: Affine, shape: Tuple[int, int]
+) -> Tuple[Tuple[slice, slice], np.ndarray]:
+    """
+    Rasterize a clip geometry once so the mask can be reused for every raster on
+    the same grid.
+
+    geometry: geometry to clip to, in the CRS of the grid
+    transform: affine transform of the grid
+    shape: (height, width) of the grid
+    Returns the row and column slices of the window covering the geometry and the
+    mask of the pixels touched by the geometry inside that window.
+    """
+    # only rasterize the window around the geometry
+    row_start, row_stop, col_start, col_stop = _pixel_window(
+        geometry.bounds, transform, shape
+    )
+
+    if row_start >= row_stop or col_start >= col_stop:
+        raise ValueError("Clip geometry does not overlap the raster.")
+
+    inside = geometry_mask(
         [geometry],
-        crs,
+        out_shape=(row_stop - row_start, col_stop - col_start),
+        transform=transform * Affine.translation(col_start, row_start),
+        invert=True,
         all_touched=True,
-        drop=True,
     )
-    return clipped
+
+    rows = np.flatnonzero(inside.any(axis=1))
+    cols = np.flatnonzero(inside.any(axis=0))
+    if not rows.size:
+        raise ValueError("Clip geometry does not overlap the raster.")
+
+    window = (
+        slice(row_start + rows[0], row_start + rows[-1] + 1),
+        slice(col_start + cols[0], col_start + cols[-1] + 1),
+    )
+    return window, inside[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
 
 
 def stack_bands(bands: list[xr.DataArray]) -> xr.DataArray:
-    stacked = xr.concat(bands, dim="band")
+    """
+    Stack single band rasters on the same grid into one multi band raster,
+    copying each band straight into a preallocated array.
+    """
+    first = bands[0]
+
+    stacked = np.empty((len(bands), *first.shape[-2:]), dtype=first.dtype)
+    for index, band in enumerate(bands):
+        stacked[index] = band.values[0]
+
+    coords = {name: coord for name, coord in first.coords.items() if name != "band"}
+    coords["band"] = np.concatenate([band.band.values for band in bands])
+
+    stacked = xr.DataArray(stacked, coords=coords, dims=first.dims, attrs=first.attrs)
+    stacked.encoding = first.encoding.copy()
     return stacked
 
 
 def compute_ndsi(band_green: xr.DataArray, band_swir: xr.DataArray) -> xr.DataArray:
-    ndsi = (band_green - band_swir) / (band_green + band_swir)
-    ndsi = ndsi.where(np.isfinite(ndsi))
+    band_green, band_swir = xr.align(band_green, band_swir)
+
+    green = band_green.values
+    swir = band_swir.values
 
-    return ndsi
+    # work on the raw arrays in place: one buffer for the result, one for the sum
+    # and one boolean buffer, NaN inputs simply propagate through the division
+    ndsi = np.subtract(green, swir, dtype=np.float32)
+    total = np.add(green, swir, dtype=np.float32)
+    nonzero = np.not_equal(total, 0)
+    np.divide(ndsi, total, out=ndsi, where=nonzero)
+    zero = np.logical_not(nonzero, out=nonzero)
+    np.copyto(ndsi, np.nan, where=zero)
+
+    # like plain xarray arithmetic, the result keeps coords and attrs but not the
+    # band encoding, so the band nodata value is not applied to the NDSI
+    return xr.DataArray(
+        ndsi, coords=band_green.coords, dims=band_green.dims, attrs=band_green.attrs
+    )
 
 
 def create_mask(layer: xr.DataArray, threshold: float = 0.4) -> xr.DataArray:
-    mask = layer >= threshold
+    """
+    Threshold a layer into a uint8 mask: 1 where the layer is at least the
+    threshold, 0 below it and MASK_NODATA where the layer has no data.
+    """
+    values = layer.values
+
+    mask = np.greater_equal(values, threshold).view(np.uint8)
+    finite = np.isfinite(values)
+    np.copyto(mask, MASK_NODATA, where=np.logical_not(finite, out=finite))
+
+    return xr.DataArray(
+        mask, coords=layer.coords, dims=layer.dims, attrs=layer.attrs
+    ).rio.write_nodata(MASK_NODATA)
 
-    mask = mask.where(np.isfinite(layer))
-    return mask
 
+def grouped_percentile(
+    labels: np.ndarray, values: np.ndarray, q: float, n_labels: int
+) -> np.ndarray:
+    """
+    Compute the q-th percentile of values for every label with the same linear
+    interpolation as np.percentile, selecting with np.partition instead of
+    fully sorting each group.
+
+    labels: non-negative integer label of each value
+    values: values to compute the percentiles of
+    q: percentile to compute, between 0 and 100
+    n_labels: number of labels, labels must be smaller than this
+    Returns an array of n_labels percentiles, NaN for labels without values.
+    """
+    # group the values by label, a stable sort of small integers is a radix sort
+    order = np.argsort(
+        labels.astype(np.min_scalar_type(n_labels - 1), copy=False), kind="stable"
+    )
+    grouped_values = values[order]
 
-def analyze_glacier_snow_area(
-    glacier_id: str,
-    glacier_geom: MultiPolygon,
+    counts = np.bincount(labels, minlength=n_labels)
+    starts = np.cumsum(counts) - counts
+
+    result = np.full(n_labels, np.nan)
+
+    for label in np.flatnonzero(counts):
+        group = grouped_values[starts[label] : starts[label] + counts[label]]
+
+        position = (counts[label] - 1) * (q / 100)
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+
+        # grouped_values is our own copy, so partition the group in place
+        group.partition((lower, upper))
+        result[label] = group[lower] + (group[upper] - group[lower]) * (
+            position - lower
+        )
+
+    return result
+
+
+def analyze_glaciers_snow_area(
+    glaciers: List[Tuple[str, MultiPolygon]],
     dem: xr.DataArray,
     ndsi_mask: xr.DataArray,
     pixel_area: float,
     scene_id: str,
     analysis_id: str,
-) -> GlacierSnowData:
-    logger.info(f"Processing glacier {glacier_id}")
+) -> List[GlacierSnowData]:
+    logger.info(f"Processing {len(glaciers)} glaciers")
+
+    if not glaciers:
+        return []
+
+    n_labels = len(glaciers) + 1
+    shape = ndsi_mask.shape[-2:]
+    transform = ndsi_mask.rio.transform()
+
+    # burn all glaciers into one label raster instead of clipping the rasters
+    # per glacier, 0 is background and glacier i gets label i + 1
+    labels = rasterize(
+        [(glacier_geom, index + 1) for index, (_, glacier_geom) in enumerate(glaciers)],
+        out_shape=shape,
+        transform=transform,
+        fill=0,
+        all_touched=True,
+        dtype="int32",
+    )
+    # a pixel touched by several glaciers only keeps the last label, count the
+    # glaciers per pixel so those pixels can be credited to each of them
+    touching = rasterize(
+        [(glacier_geom, 1) for _, glacier_geom in glaciers],
+        out_shape=shape,
+        transform=transform,
+        fill=0,
+        all_touched=True,
+        merge_alg=MergeAlg.add,
+        dtype="int32",
+    )
+    shared = touching > 1
+    labels[shared] = 0
+
+    snow = ndsi_mask.values.reshape(shape) == 1
+    elevations = dem.values.reshape(shape)
+
+    exclusive_snow = snow & (labels > 0)
+    snow_labels = [labels[exclusive_snow]]
+    snow_elevations = [elevations[exclusive_snow]]
 
-    glacier_mask = clip_raster(ndsi_mask, glacier_geom, ndsi_mask.rio.crs)
-    clipped_dem = clip_raster(dem, glacier_geom, dem.rio.crs)
+    shared_snow = snow & shared
+    if shared_snow.any():
+        # shared pixels count for every glacier touching them, the same as
+        # clipping each glacier on its own
+        for index, (_, glacier_geom) in enumerate(glaciers):
+            row_start, row_stop, col_start, col_stop = _pixel_window(
+                glacier_geom.bounds, transform, shape
+            )
+            if not shared_snow[row_start:row_stop, col_start:col_stop].any():
+                continue
 
-    glacier_snow_area = int(glacier_mask.sum().item()) * pixel_area
+            window, inside = rasterize_clip_mask(glacier_geom, transform, shape)
+            glacier_shared = inside & shared_snow[window]
+            snow_labels.append(
+                np.full(np.count_nonzero(glacier_shared), index + 1, dtype="int32")
+            )
+            snow_elevations.append(elevations[window][glacier_shared])
 
-    snow_elevations = clipped_dem.where(glacier_mask).values.flatten()
-    snow_elevations = snow_elevations[np.isfinite(snow_elevations)]
+    snow_labels = np.concatenate(snow_labels)
+    snow_elevations = np.concatenate(snow_elevations)
 
-    snowline_elevation = np.percentile(snow_elevations, 20)
+    snow_pixels = np.bincount(snow_labels, minlength=n_labels)
 
-    result = GlacierSnowData(
-        id=f"{scene_id}_{glacier_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}",
-        analysis_id=analysis_id,
-        glacier_id=glacier_id,
-        scene_id=scene_id,
-        snow_area_m2=glacier_snow_area,
-        snowline_elevation_m=snowline_elevation,
+    finite = np.isfinite(snow_elevations)
+    snowline_elevations = grouped_percentile(
+        snow_labels[finite], snow_elevations[finite], 20, n_labels
     )
 
-    return result
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    results = []
+
+    for index, (glacier_id, _) in enumerate(glaciers):
+        label = index + 1
+
+        if np.isnan(snowline_elevations[label]):
+            logger.warning(f"No snow elevations for glacier {glacier_id}. Skipping.")
+            continue
+
+        results.append(
+            GlacierSnowData(
+                id=f"{scene_id}_{glacier_id}_{timestamp}",
+                analysis_id=analysis_id,
+                glacier_id=glacier_id,
+                scene_id=scene_id,
+                snow_area_m2=int(snow_pixels[label]) * pixel_area,
+                snowline_elevation_m=snowline_elevations[label],
+            )
+        )
+
+    return results
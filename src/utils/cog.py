@@ -1,8 +1,24 @@
+import threading
 from dataclasses import dataclass
 from typing import Tuple
 
 import requests
 
+# first four bytes of little and big endian TIFF and BigTIFF files, read as a
+# little endian uint32
+_TIFF_MAGICS = {0x002A4949, 0x2A004D4D, 0x002B4949, 0x2B004D4D}
+
+# one session per thread, so the checks of consecutive assets on a thread reuse
+# keep-alive connections without sharing a Session between threads
+_local = threading.local()
+
+
+def _get_session() -> requests.Session:
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
 
 @dataclass
 class IsCogInfo:
@@ -15,46 +31,34 @@ class IsCogInfo:
 def is_cog(logger, href: str, headers: dict = {}) -> Tuple[bool, IsCogInfo]:
     info = IsCogInfo(accept_ranges=None, content_type=None, tiff_magic=None)
     try:
-        head_resp = requests.head(
-            href, headers=headers, allow_redirects=True, timeout=15
-        )
-        head_resp.raise_for_status()
-
-        info.accept_ranges = head_resp.headers.get("Accept-Ranges")
-        info.content_type = head_resp.headers.get("Content-Type")
-    except Exception as e:
-        info.accept_ranges = None
-        info.content_type = None
-        logger.error(f"Error fetching headers for {href}: {e}")
-
-    try:
-        range_resp = requests.get(
+        # the ranged GET carries the same headers a HEAD request would, so one
+        # round trip is enough
+        with _get_session().get(
             href,
             headers={**headers, "Range": "bytes=0-3"},
+            allow_redirects=True,
             stream=True,
             timeout=15,
-        )
-        range_resp.raise_for_status()
+        ) as range_resp:
+            range_resp.raise_for_status()
+
+            info.accept_ranges = range_resp.headers.get("Accept-Ranges")
+            if info.accept_ranges is None and range_resp.status_code == 206:
+                # partial responses often leave the header out
+                info.accept_ranges = "bytes"
+            info.content_type = range_resp.headers.get("Content-Type")
 
-        header = range_resp.content
+            # a server ignoring the range sends the whole file, only read the start
+            header = range_resp.raw.read(16)
 
         if len(header) < 4:
-            info.tiff_magic = False
             info.header_bytes = str(header)
         elif len(header) > 10:
-            info.tiff_magic = False
             info.header_bytes = str(header[:10])
 
-        if (
-            header.startswith(b"II*\x00")
-            or header.startswith(b"MM\x00*")
-            or header.startswith(b"II+\x00")
-            or header.startswith(b"MM\x00+")
-        ):
-            info.tiff_magic = True
-        else:
-            info.tiff_magic = False
-            # info.header_bytes = str(header)
+        info.tiff_magic = (
+            len(header) >= 4 and int.from_bytes(header[:4], "little") in _TIFF_MAGICS
+        )
     except Exception as e:
         info.tiff_magic = None
         logger.error(f"Error fetching range bytes for {href}: {e}")
@@ -21,6 +21,9 @@ class Config:
     cdse_password: str = os.getenv("CDSE_PASSWORD", "")
 
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./glacier_watch.db")
+    database_pool_size: int = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+    database_max_overflow: int = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+    database_pool_recycle: int = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
 
     dem_stac_url: str = os.getenv(
         "DEM_STAC_URL",
@@ -2,7 +2,7 @@
 from collections.abc import Generator
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.orm import Session
 
 from src.utils.config import config
@@ -12,7 +12,24 @@ logger = get_logger("glacier_watch.db")
 
 logger.debug("Connecting to database")
 
-engine = create_engine(config.database_url, echo=False, pool_pre_ping=True, future=True)
+connect_args = {}
+if make_url(config.database_url).get_driver_name() == "psycopg":
+    # the worker loops run the same lock/update statements on every scene,
+    # let psycopg keep them as server-side prepared statements after first use
+    connect_args["prepare_threshold"] = 1
+
+engine = create_engine(
+    config.database_url,
+    echo=False,
+    future=True,
+    pool_size=config.database_pool_size,
+    max_overflow=config.database_max_overflow,
+    pool_timeout=30,
+    pool_recycle=config.database_pool_recycle,
+    pool_pre_ping=True,
+    pool_use_lifo=True,
+    connect_args=connect_args,
+)
 
 
 @contextmanager
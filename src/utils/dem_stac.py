@@ -1,20 +1,21 @@
-from itertools import combinations
 from logging import Logger
 from typing import Tuple
 
+import numpy as np
 import requests
-from pystac_client import Client
+import shapely
+from shapely import prepare
 from shapely.geometry import box, shape
-from shapely.ops import unary_union
 from tqdm import tqdm
 
 from src.utils.config import config
 from src.utils.geo import reproject_geom
+from src.utils.stac import open_catalog
 
 
 class DemStac:
     def __init__(self, logger: Logger, target_coverage: float = 0.99):
-        self.catalog = Client.open(config.dem_stac_url)
+        self.catalog = open_catalog(config.dem_stac_url)
         self.logger = logger
         self.target_coverage = target_coverage
 
@@ -27,33 +28,46 @@ class DemStac:
             maxy + pad_deg,
         )
 
-    def __get_item_proj_bbox_geom(self, item):
-        props = item.properties or {}
+    def __get_item_proj_bbox(self, item):
+        props = item.properties
         proj_code = props.get("proj:code")
         proj_bbox = props.get("proj:bbox")
-        proj_geom = props.get("proj:geometry")
 
         if not proj_code or not proj_bbox:
-            return None, None, None
+            return None, None
 
         if isinstance(proj_code, str) and proj_code.upper().startswith("EPSG:"):
             epsg = int(proj_code.split(":")[1])
         else:
             epsg = int(proj_code)
 
-        item_bbox = box(*proj_bbox)
+        return epsg, box(*proj_bbox)
 
-        item_geom = None
-        if proj_geom:
-            try:
-                item_geom = shape(proj_geom)
-            except Exception:
-                item_geom = None
+    def __get_item_geom(self, item, details):
+        # footprints are only built for items whose bbox passed the cheap test
+        if "geom" not in details:
+            proj_geom = item.properties.get("proj:geometry")
 
-        return epsg, item_bbox, item_geom
+            item_geom = None
+            if proj_geom:
+                try:
+                    rings = proj_geom.get("coordinates")
+                    if proj_geom.get("type") == "Polygon" and len(rings) == 1:
+                        # single ring footprints, skip the GeoJSON dispatcher
+                        item_geom = shapely.polygons(
+                            np.asarray(rings[0], dtype="float64")
+                        )
+                    else:
+                        item_geom = shape(proj_geom)
+                except Exception:
+                    item_geom = None
+
+            details["geom"] = item_geom
+
+        return details["geom"]
 
     def __score_item(self, item) -> Tuple[float, str]:
-        props = item.properties or {}
+        props = item.properties
         data_perc = float(props.get("pgc:data_perc") or 0.0)
         created = props.get("created") or ""
         return (data_perc, created)
@@ -62,11 +76,10 @@ class DemStac:
         item_details = {}
         epsg_set = set()
         for item in items:
-            epsg, item_bbox, item_geom = self.__get_item_proj_bbox_geom(item)
+            epsg, item_bbox = self.__get_item_proj_bbox(item)
             item_details[item.id] = {
                 "epsg": epsg,
                 "bbox": item_bbox,
-                "geom": item_geom,
             }
             if epsg:
                 epsg_set.add(epsg)
@@ -80,25 +93,47 @@ class DemStac:
         candidates = []
         polygon_area = polygon.area
 
-        for item in items:
-            details = item_details.get(item.id, {})
-
-            item_bbox = details.get("bbox")
-            item_geom = details.get("geom")
+        # every item is tested against the same polygon, prepare it once. Only the
+        # first argument of a predicate uses the prepared geometry
+        prepare(polygon)
 
-            if not item_bbox.intersects(polygon):
-                continue
+        # test every item bbox in a single vectorized call, items without a bbox
+        # never intersect
+        item_bboxes = np.array(
+            [item_details.get(item.id, {}).get("bbox") for item in items],
+            dtype=object,
+        )
+        bbox_hits = shapely.intersects(polygon, item_bboxes)
 
-            test_geom = item_geom if item_geom is not None else item_bbox
+        hit_items = [item for item, bbox_hit in zip(items, bbox_hits) if bbox_hit]
+        test_geoms = []
+        for item in hit_items:
+            details = item_details.get(item.id, {})
+            item_geom = self.__get_item_geom(item, details)
+            test_geoms.append(item_geom if item_geom is not None else details["bbox"])
+
+        # footprint tests and overlap areas for all bbox hits in two GEOS calls
+        test_geoms = np.array(test_geoms, dtype=object)
+        geom_hits = shapely.intersects(polygon, test_geoms)
+        intersect_areas = np.zeros(len(test_geoms))
+        intersect_areas[geom_hits] = shapely.area(
+            shapely.intersection(test_geoms[geom_hits], polygon)
+        )
 
-            if not test_geom.intersects(polygon):
+        for item, geom_hit, intersect_area in zip(
+            hit_items, geom_hits, intersect_areas
+        ):
+            if not geom_hit:
                 continue
 
-            intersect_area = test_geom.intersection(polygon).area
             coverage = intersect_area / polygon_area
 
             self.logger.debug(
-                f"Item {item.id} coverage: {coverage:.4f} (intersect area: {intersect_area}, poly area: {polygon_area})"
+                "Item %s coverage: %.4f (intersect area: %s, poly area: %s)",
+                item.id,
+                coverage,
+                intersect_area,
+                polygon_area,
             )
 
             candidates.append((item, coverage))
@@ -158,28 +193,29 @@ class DemStac:
                 (item, item_geom if item_geom is not None else item_bbox)
             )
 
-        best = None
-        for r in range(1, len(tile_shapes) + 1):
-            for combo in combinations(tile_shapes, r):
-                union_geom = unary_union([shape for _, shape in combo])
-                intersect_area = union_geom.intersection(poly_proj).area
-                coverage = intersect_area / polygon_area
-
-                if best is None or coverage > best[0]:
-                    best = (coverage, [item for item, _ in combo])
-
-                if coverage >= self.target_coverage:
-                    chosen = [item for item, _ in combo]
-                    self.logger.info(
-                        f"Selected {len(chosen)} DEM items to cover AOI with coverage {coverage:.4f}"
-                    )
-                    return chosen
+        # greedy set cover: keep adding the tile that covers the most of the
+        # still uncovered AOI, ties go to the better scored candidate
+        uncovered = poly_proj
+        coverage = 0.0
+        chosen = []
+
+        while tile_shapes and coverage < self.target_coverage:
+            gains = [
+                tile_shape.intersection(uncovered).area for _, tile_shape in tile_shapes
+            ]
+            best_index = max(range(len(gains)), key=gains.__getitem__)
+            if gains[best_index] <= 0:
+                break
+
+            item, tile_shape = tile_shapes.pop(best_index)
+            chosen.append(item)
+            uncovered = uncovered.difference(tile_shape)
+            coverage = 1 - uncovered.area / polygon_area
 
-        best_coverage, best_items = best
         self.logger.info(
-            f"Selected {len(best_items)} DEM items to cover AOI with coverage {best_coverage:.4f}"
+            f"Selected {len(chosen)} DEM items to cover AOI with coverage {coverage:.4f}"
         )
-        return best_items
+        return chosen
 
     def download_dem_asset(self, item, download_path: str, asset_key: str = "dem"):
         dem_asset = item.assets.get(asset_key)
@@ -1,3 +1,4 @@
+import shutil
 from pathlib import Path
 from typing import Literal
 
@@ -5,22 +6,32 @@ import rioxarray as rxr
 import xarray as xr
 
 
-def load_raster(file_path) -> xr.DataArray:
-    raster = rxr.open_rasterio(file_path, masked=True)
+def load_raster(file_path, lock=None) -> xr.DataArray:
+    raster = rxr.open_rasterio(file_path, masked=True, lock=lock)
     return raster
 
 
 def save_raster(data_array: xr.DataArray, file_path: str):
-    data_array.rio.to_raster(file_path)
+    """
+    Write a raster as a tiled, LZW compressed Cloud Optimized GeoTIFF. The
+    predictor is picked by GDAL from the data type, horizontal differencing for
+    integers and floating point prediction for floats.
+    """
+    data_array.rio.to_raster(
+        file_path,
+        driver="COG",
+        compress="LZW",
+        predictor="YES",
+        blocksize=512,
+        BIGTIFF="IF_SAFER",
+    )
 
 
 def prepare_temp_folder() -> Path:
     temp_folder_path = Path("data/temp/")
 
     if temp_folder_path.is_dir():
-        for file in temp_folder_path.iterdir():
-            file.unlink()
-        temp_folder_path.rmdir()
+        shutil.rmtree(temp_folder_path)
 
     temp_folder_path.mkdir(parents=True, exist_ok=True)
 
@@ -31,9 +42,7 @@ def cleanup_temp_folder():
     temp_folder_path = Path("data/temp/")
 
     if temp_folder_path.is_dir():
-        for file in temp_folder_path.iterdir():
-            file.unlink()
-        temp_folder_path.rmdir()
+        shutil.rmtree(temp_folder_path)
 
 
 def prepare_folder(
@@ -42,9 +51,7 @@ def prepare_folder(
     raw_folder_path = Path(f"data/{folder_type}/{project_id}/{scene_id}")
 
     if raw_folder_path.is_dir():
-        for file in raw_folder_path.iterdir():
-            file.unlink()
-        raw_folder_path.rmdir()
+        shutil.rmtree(raw_folder_path)
 
     raw_folder_path.mkdir(parents=True, exist_ok=True)
 
@@ -1,9 +1,71 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List
+
+import numpy as np
 import pyproj
+import shapely
+from shapely import STRtree, area, from_wkb
 from shapely.ops import transform
 
 
+@lru_cache(maxsize=32)
+def _get_transformer(source_crs: str, target_crs: str) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
 def reproject_geom(geometry, source_crs: str, target_crs: str):
     if source_crs == target_crs:
         return geometry
-    transformer = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    transformer = _get_transformer(source_crs, target_crs)
     return transform(transformer.transform, geometry)
+
+
+def reproject_geoms(geometries, source_crs: str, target_crs: str) -> np.ndarray:
+    """
+    Reproject an array of geometries with a single transformer call over all
+    of their coordinates.
+
+    geometries: array-like of shapely geometries
+    source_crs: CRS of the geometries
+    target_crs: CRS to reproject to
+    Returns an object array of reprojected geometries.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if source_crs == target_crs:
+        return geometries
+    transformer = _get_transformer(source_crs, target_crs)
+    return shapely.transform(geometries, transformer.transform, interleaved=False)
+
+
+@dataclass
+class GlacierIndex:
+    names: np.ndarray
+    geometries: np.ndarray
+    areas: np.ndarray
+    tree: STRtree
+
+    def query(self, geometry) -> np.ndarray:
+        """
+        Return the sorted indices of the glaciers intersecting the geometry.
+        """
+        return np.sort(self.tree.query(geometry, predicate="intersects"))
+
+
+def build_glacier_index(names: List[str], wkbs: List) -> GlacierIndex:
+    """
+    Build a spatial index over glacier geometries.
+
+    names: glacier names, parallel to wkbs
+    wkbs: WKB payloads of the glacier geometries
+    Returns a GlacierIndex with parallel name, geometry and area arrays.
+    """
+    # decode all glacier geometries in a single GEOS call
+    geometries = from_wkb(np.array(wkbs, dtype=object))
+
+    return GlacierIndex(
+        names=np.array(names, dtype=object),
+        geometries=geometries,
+        areas=area(geometries),
+        tree=STRtree(geometries),
+    )
@@ -2,15 +2,16 @@ import logging
 import os
 from typing import Any
 
-from pythonjsonlogger.json import JsonFormatter
+from pythonjsonlogger.orjson import OrjsonFormatter
 
 _log_format = "%(asctime)s - [%(levelname)s] - %(name)s - %(funcName)s - %(message)s"
 
 
-class CustomJsonFormatter(JsonFormatter):
+class CustomJsonFormatter(OrjsonFormatter):
     """Custom JSON formatter for logging
 
     It automatically adds the location of the log record to the JSON log message.
+    Records are serialized with orjson.
     """
 
     def add_fields(
@@ -2,8 +2,18 @@ import enum
 from datetime import datetime
 
 from geoalchemy2 import Geometry
-from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.sql import text
 
 Base = declarative_base()
 
@@ -22,13 +32,21 @@ class SceneStatusEnum(str, enum.Enum):
 
 class Project(Base):
     __tablename__ = "project"
+    __table_args__ = (
+        Index(
+            "idx_project_area_of_interest",
+            "area_of_interest",
+            postgresql_using="spgist",
+        ),
+    )
+
     project_id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.now, nullable=False)
 
     area_of_interest = Column(
-        Geometry(geometry_type="MULTIPOLYGON", srid=4326, spatial_index=True),
+        Geometry(geometry_type="MULTIPOLYGON", srid=4326, spatial_index=False),
         nullable=True,
     )
 
@@ -37,6 +55,23 @@ class Scene(Base):
     """Circuit breaker entry for a single satellite scene."""
 
     __tablename__ = "scene"
+    __table_args__ = (
+        Index(
+            "ix_scene_acq_date_brin",
+            "acquisition_date",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ),
+        Index(
+            "ix_scene_queue",
+            "status",
+            text("acquisition_date DESC"),
+            postgresql_include=["scene_id"],
+            postgresql_where=text(
+                "status IN ('queued_for_download', 'queued_for_processing')"
+            ),
+        ),
+    )
 
     scene_id = Column(String, primary_key=True)
     project_id = Column(String, ForeignKey("project.project_id"), index=True)
@@ -1,19 +1,177 @@
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from functools import lru_cache
 from logging import Logger
+from types import MappingProxyType
 
 import requests
 from pystac_client import Client
+from requests.adapters import HTTPAdapter
 from shapely.geometry import Polygon, mapping
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 from src.utils.config import config
 
+# assets larger than one chunk are downloaded as parallel byte ranges
+RANGE_CHUNK_SIZE = 8 * 1024 * 1024
+RANGE_WORKERS = 4
+
+# seconds before their expiry at which CDSE tokens are renewed
+TOKEN_EXPIRY_MARGIN = 60
+
+# read size for streamed downloads
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# chunks buffered between the network reader and the disk writer
+WRITE_QUEUE_DEPTH = 4
+
+# progress bars only when someone is watching, batch runs log instead
+SHOW_PROGRESS = sys.stderr.isatty()
+
+# CDSE s3 asset hrefs are rewritten to the public https endpoint
+_S3_PREFIX = "s3://eodata/"
+_S3_HTTPS_ENDPOINT = "https://eodata.dataspace.copernicus.eu/"
+
+_EMPTY = MappingProxyType({})
+
+
+def preallocate(fd: int, size: int):
+    """
+    Reserve size bytes on disk for fd up front so the filesystem can lay the
+    file out in contiguous extents. Falls back to ftruncate where
+    posix_fallocate is unavailable or unsupported by the filesystem.
+    """
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def download_range(
+    session: requests.Session, asset_href, headers, fd: int, start: int, end: int
+):
+    """
+    Download one byte range of an asset and write it at its offset in fd.
+    """
+    range_headers = {**headers, "Range": f"bytes={start}-{end}"}
+
+    with session.get(asset_href, headers=range_headers, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise requests.HTTPError(
+                f"Expected partial content for range {start}-{end}, got {response.status_code}",
+                response=response,
+            )
+
+        offset = start
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+
+def download_ranges(
+    session: requests.Session, asset_href, headers, download_path, size: int
+):
+    """
+    Download an asset of known size as RANGE_CHUNK_SIZE byte ranges fetched over
+    RANGE_WORKERS parallel connections.
+    """
+    ranges = [
+        (start, min(start + RANGE_CHUNK_SIZE, size) - 1)
+        for start in range(0, size, RANGE_CHUNK_SIZE)
+    ]
+
+    fd = os.open(download_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        preallocate(fd, size)
+        with ThreadPoolExecutor(max_workers=RANGE_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    download_range, session, asset_href, headers, fd, start, end
+                )
+                for start, end in ranges
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
+@lru_cache(maxsize=4)
+def open_catalog(url: str) -> Client:
+    """
+    Open a STAC catalog once per process, later calls reuse the parsed root.
+    """
+    return Client.open(url)
+
+
+def copy_pipelined(source, destination, length: int = DOWNLOAD_CHUNK_SIZE):
+    """
+    Copy source to destination like shutil.copyfileobj, but write on a separate
+    thread so reading the next chunk overlaps with writing the previous one.
+    At most WRITE_QUEUE_DEPTH chunks are held in memory.
+    """
+    chunks = queue.Queue(maxsize=WRITE_QUEUE_DEPTH)
+    errors = []
+
+    def write_chunks():
+        # keep draining after a failure so the reader never blocks on put
+        while (chunk := chunks.get()) is not None:
+            if not errors:
+                try:
+                    destination.write(chunk)
+                except Exception as e:
+                    errors.append(e)
+
+    writer = threading.Thread(target=write_chunks, daemon=True)
+    writer.start()
+    try:
+        while not errors and (chunk := source.read(length)):
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
 
 class Stac:
     def __init__(self, logger: Logger):
-        self.catalog = Client.open(config.stac_url)
         self.logger = logger
 
+        # one pooled session so band and range downloads reuse TCP/TLS connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._cdse_token = None
+        self._cdse_token_expires_at = 0.0
+        self._cdse_refresh_token = None
+        self._cdse_refresh_expires_at = 0.0
+        # download threads share the token, only one of them renews it
+        self._cdse_token_lock = threading.Lock()
+
+    @property
+    def catalog(self) -> Client:
+        # opened on first search, download only runs never fetch the catalog root
+        return open_catalog(config.stac_url)
+
     def search_sentinel2_data(self, polygon: Polygon, date_from: date, date_to: date):
         search = self.catalog.search(
             collections=["sentinel-2-l2a"],
@@ -21,11 +179,8 @@ class Stac:
             datetime=f"{date_from.isoformat()}/{date_to.isoformat()}",
             query={"eo:cloud_cover": {"lt": float(config.cloud_cover_threshold) * 100}},
         )
-        items = list(search.items())
-        self.logger.info(
-            f"Found {len(items)} Sentinel-2 items between {date_from} and {date_to}."
-        )
-        return items
+        # pages are fetched lazily while the caller iterates
+        yield from search.items()
 
     def __get_cdse_token(self) -> str:
         if not config.cdse_username or not config.cdse_password:
@@ -36,18 +191,34 @@ class Stac:
                 "CDSE_USERNAME and CDSE_PASSWORD must be set in environment variables."
             )
 
-        data = {
-            "grant_type": "password",
-            "client_id": "cdse-public",
-            "username": config.cdse_username,
-            "password": config.cdse_password,
-        }
+        now = time.monotonic()
 
-        resp = requests.post(
+        if self._cdse_refresh_token and now < self._cdse_refresh_expires_at:
+            # a refresh grant is cheaper than a full password login
+            data = {
+                "grant_type": "refresh_token",
+                "client_id": "cdse-public",
+                "refresh_token": self._cdse_refresh_token,
+            }
+        else:
+            data = {
+                "grant_type": "password",
+                "client_id": "cdse-public",
+                "username": config.cdse_username,
+                "password": config.cdse_password,
+            }
+
+        resp = self.session.post(
             config.stac_token_url,
             data=data,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
         )
+
+        if not resp.ok and data["grant_type"] == "refresh_token":
+            self.logger.info("CDSE refresh token rejected, logging in again.")
+            self._cdse_refresh_token = None
+            return self.__get_cdse_token()
+
         resp.raise_for_status()
 
         data = resp.json()
@@ -58,31 +229,44 @@ class Stac:
             raise SystemExit("Could not obtain access_token from CDSE response.")
 
         self._cdse_token = token
+        # renew a minute before the token actually expires
+        self._cdse_token_expires_at = (
+            now + int(data.get("expires_in", 600)) - TOKEN_EXPIRY_MARGIN
+        )
+        self._cdse_refresh_token = data.get("refresh_token")
+        self._cdse_refresh_expires_at = (
+            now + int(data.get("refresh_expires_in", 0)) - TOKEN_EXPIRY_MARGIN
+        )
 
         return token
 
     def get_cdse_token(self, refresh=False) -> str:
-        if not refresh and hasattr(self, "_cdse_token"):
+        if self.__has_valid_token(refresh):
             return self._cdse_token
-        return self.__get_cdse_token()
 
-    @staticmethod
-    def parse_asset_href(asset) -> str:
-        href = asset.href
+        with self._cdse_token_lock:
+            # another thread may have renewed it while we waited
+            if self.__has_valid_token(refresh):
+                return self._cdse_token
+            return self.__get_cdse_token()
 
-        extra = getattr(asset, "extra_fields", {})
-        alternates = extra.get("alternate") or extra.get("alternates") or {}
+    def __has_valid_token(self, refresh: bool) -> bool:
+        return (
+            not refresh
+            and self._cdse_token is not None
+            and time.monotonic() < self._cdse_token_expires_at
+        )
 
-        https_alt = alternates.get("https")
-        if https_alt and "href" in https_alt:
-            href = https_alt["href"]
+    @staticmethod
+    def parse_asset_href(asset) -> str:
+        extra = getattr(asset, "extra_fields", None) or _EMPTY
+        alternates = extra.get("alternate") or extra.get("alternates") or _EMPTY
+        href = (alternates.get("https") or _EMPTY).get("href") or asset.href
 
-        if href.startswith("https://") or href.startswith("http://"):
+        if href.startswith(("https://", "http://")):
             return href
-        elif href.startswith("s3://eodata/"):
-            return href.replace(
-                "s3://eodata/", "https://eodata.dataspace.copernicus.eu/"
-            )
+        elif href.startswith(_S3_PREFIX):
+            return _S3_HTTPS_ENDPOINT + href[len(_S3_PREFIX) :]
 
     def download_item_assets(self, asset_href, download_path: str):
         token = self.get_cdse_token()
@@ -90,15 +274,38 @@ class Stac:
         headers = {"Authorization": f"Bearer {token}"}
 
         try:
-            with requests.get(asset_href, headers=headers, stream=True) as response:
-                response.raise_for_status()
-                with open(download_path, "wb") as f:
-                    for chunk in tqdm(
-                        response.iter_content(chunk_size=8192),
-                        desc=f"Downloading {download_path.name}",
+            head = self.session.head(asset_href, headers=headers, allow_redirects=True)
+            size = int(head.headers.get("Content-Length", 0))
+
+            if (
+                head.ok
+                and head.headers.get("Accept-Ranges") == "bytes"
+                and size > RANGE_CHUNK_SIZE
+            ):
+                # large asset, fetch byte ranges over parallel connections
+                download_ranges(self.session, asset_href, headers, download_path, size)
+            else:
+                with self.session.get(
+                    asset_href, headers=headers, stream=True
+                ) as response:
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    with (
+                        open(download_path, "wb") as f,
+                        tqdm.wrapattr(
+                            f,
+                            "write",
+                            total=(size if head.ok else 0) or None,
+                            desc=f"Downloading {download_path.name}",
+                            disable=not SHOW_PROGRESS,
+                            mininterval=0.5,
+                        ) as out,
                     ):
-                        if chunk:
-                            f.write(chunk)
+                        if head.ok and size:
+                            preallocate(f.fileno(), size)
+                        copy_pipelined(response.raw, out)
+                        # drop any preallocated tail the body did not fill
+                        f.truncate(f.tell())
         except requests.HTTPError as e:
             self.logger.error(f"Failed to download asset from {asset_href}: {e}")
             raise